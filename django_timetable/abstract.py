@@ -1,3 +1,5 @@
+import types
+
 from django.db import models
 
 class AbstractMixin(object):
@@ -12,7 +14,8 @@ class AbstractMixin(object):
         attrs = cls.contribute(*args, **kwargs)
         attrs.update({
             '__module__': cls.__module__,
-            'Meta': type('Meta', (), {'abstract': True}),
+            # keep parent Meta options (ordering, unique_together etc.)
+            'Meta': types.ClassType('Meta', (cls.Meta, ), {'abstract': True}),
         })
         cls._cls_counter += 1
         clsname = '%s_%i' % (cls.__name__, cls._cls_counter)
@@ -8,10 +8,27 @@ from functools import partial
 from django.db import models
 
 
+# frequencies with constant distance between occurrences
+FIXED_FREQUENCY_STEPS = {
+    rrule.WEEKLY: datetime.timedelta(weeks=1),
+    rrule.DAILY: datetime.timedelta(days=1),
+    rrule.HOURLY: datetime.timedelta(hours=1),
+    rrule.MINUTELY: datetime.timedelta(minutes=1),
+    rrule.SECONDLY: datetime.timedelta(seconds=1),
+}
+
+
 class BaseRruleValue(object):
     def __call__(self, period_start, period_end):
         raise NotImplementedError
 
+    def get_step(self):
+        """
+        Returns constant distance between occurrences (so expansion can start
+        at any occurrence) or None for irregular rules.
+        """
+        return None
+
 
 class RruleField(models.PositiveIntegerField):
     """
@@ -28,6 +45,12 @@ class RruleField(models.PositiveIntegerField):
             return rrule.rrule(freq=self.frequency, interval=self.interval,
                                dtstart=period_start, until=period_end)
 
+        def get_step(self):
+            step = FIXED_FREQUENCY_STEPS.get(self.frequency)
+            if step is None or not self.interval:
+                return None
+            return step * self.interval
+
     def __init__(self, frequency, *args, **kwargs):
         self.frequency = frequency
         super(RruleField, self).__init__(*args, **kwargs)
@@ -76,6 +99,14 @@ class ComplexRruleField(models.CharField):
         def __call__(self, period_start, period_end):
             return self.rule(dtstart=period_start, until=period_end)
 
+        def get_step(self):
+            if self.args or set(self.kwargs) - set(['freq', 'interval']):
+                return None
+            step = FIXED_FREQUENCY_STEPS.get(self.kwargs.get('freq'))
+            if step is None:
+                return None
+            return step * self.kwargs.get('interval', 1)
+
 
     def __init__(self, *args, **kwargs):
         #you can define rrules consts by:
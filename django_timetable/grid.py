@@ -0,0 +1,101 @@
+import datetime
+import heapq
+import math
+
+from .occupancy import get_series_queryset, get_overlapping_series, get_persisted_occurrences, overlaps
+
+GRANULARITIES = {
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+}
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
+
+class Cell(object):
+    """
+    Grid cell - entries are (occurrence, lane) pairs ordered by occurrence start.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.entries = []
+
+    def __repr__(self):
+        return '<Cell %s - %s: %i>' % (self.start, self.end, len(self.entries))
+
+
+class Grid(object):
+    def __init__(self, start, end, step):
+        self.start = start
+        self.end = end
+        self.step = step
+        count = int(math.ceil(_seconds(end - start) / _seconds(step)))
+        self.cells = [Cell(start + i*step, min(start + (i+1)*step, end)) for i in range(count)]
+        # number of lanes required to lay out overlapping occurrences side by side
+        self.lanes = 0
+
+    def _get_index(self, moment):
+        return int(_seconds(moment - self.start) // _seconds(self.step))
+
+    def add(self, occurrence, lane):
+        first = self._get_index(max(occurrence.start, self.start))
+        if occurrence.end > occurrence.start:
+            # end is exclusive
+            last = int(math.ceil(_seconds(min(occurrence.end, self.end) - self.start)
+                                 / _seconds(self.step))) - 1
+        else:
+            last = first
+        for cell in self.cells[first:last+1]:
+            cell.entries.append((occurrence, lane))
+
+
+def build_grid(series, period_start, period_end, granularity='day'):
+    """
+    Builds grid of cells (hour or day long - for day/week/month views) for
+    given period from occurrences of calendar series (calendar, manager or
+    queryset). Multi cell occurrences are referenced from all cells they
+    touch and every occurrence gets layout lane (lowest one which is free
+    during whole occurrence). Occurrences are processed in one sorted pass.
+    """
+    try:
+        step = GRANULARITIES[granularity]
+    except KeyError:
+        raise ValueError("Unknown granularity: %r (choices: %r)" % (granularity, sorted(GRANULARITIES)))
+    grid = Grid(period_start, period_end, step)
+
+    series = get_series_queryset(series)
+    occurrences, persisted = [], set()
+    for occurrence in get_persisted_occurrences(series, period_start, period_end):
+        persisted.add((occurrence.event_id, occurrence.original_start))
+        if overlaps(occurrence.start, occurrence.end, period_start, period_end):
+            occurrences.append(occurrence)
+    occurrence_model = series.model.occurrences.related.model
+    for s in get_overlapping_series(series, period_start, period_end):
+        delta = s.end - s.start
+        # occurrences which started before period can run into it
+        for start in s._get_starts(period_start - delta):
+            if start >= period_end:
+                break
+            if (s.pk, start) in persisted or not overlaps(start, start+delta, period_start, period_end):
+                continue
+            occurrences.append(s._get_occurrence(start, occurrence_model))
+    occurrences.sort(key=lambda o: (o.start, o.end))
+
+    # busy lanes heap entries: (end, zero length flag, lane) - zero length
+    # occurrence keeps its lane until next (later) start
+    busy, free = [], []
+    for occurrence in occurrences:
+        while busy and (busy[0][0] < occurrence.start
+                        or (busy[0][0] == occurrence.start and not busy[0][1])):
+            heapq.heappush(free, heapq.heappop(busy)[2])
+        if free:
+            lane = heapq.heappop(free)
+        else:
+            lane = grid.lanes
+            grid.lanes += 1
+        heapq.heappush(busy, (occurrence.end, occurrence.end <= occurrence.start, lane))
+        grid.add(occurrence, lane)
+    return grid
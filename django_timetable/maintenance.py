@@ -0,0 +1,40 @@
+import time
+
+from django.db.models import F
+
+
+def _delete_in_batches(queryset, batch_size, sleep):
+    deleted = 0
+    model = queryset.model
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        model._default_manager.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        if len(pks) < batch_size:
+            return deleted
+        if sleep:
+            time.sleep(sleep)
+
+
+def prune_occurrences(queryset, before, batch_size=500, sleep=0):
+    """
+    Deletes (in batches of batch_size, sleeping between them) materialized
+    occurrences which end before given date and were not modified - such
+    occurrences are generated again from series rule when needed.
+    Returns number of deleted occurrences.
+    """
+    queryset = queryset.filter(end__lt=before, original_end__lt=before,
+                               start=F('original_start'), end=F('original_end'))
+    return _delete_in_batches(queryset, batch_size, sleep)
+
+
+def delete_orphaned_occurrences(queryset, batch_size=500, sleep=0):
+    """
+    Deletes occurrences which are left beyond end recurring period of their
+    (shortened) series. Returns number of deleted occurrences.
+    """
+    queryset = queryset.filter(event__end_recurring_period__isnull=False,
+                               original_start__gt=F('event__end_recurring_period'))
+    return _delete_in_batches(queryset, batch_size, sleep)
@@ -0,0 +1,44 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+
+from ...maintenance import prune_occurrences, delete_orphaned_occurrences
+
+
+class Command(BaseCommand):
+    args = '<app_label.OccurrenceModel app_label.OccurrenceModel ...>'
+    help = ('Deletes not modified materialized occurrences older than retention period '
+            'and optionally occurrences left beyond end of recurring period of their series.')
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=30,
+                    help='Retention period in days (default: 30).'),
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+                    help='Number of occurrences deleted in one query (default: 500).'),
+        make_option('--sleep', type='float', dest='sleep', default=0,
+                    help='Seconds to sleep between batches (default: 0).'),
+        make_option('--orphans', action='store_true', dest='orphans', default=False,
+                    help='Delete also occurrences beyond end recurring period of their series.'),
+    )
+
+    def handle(self, *labels, **options):
+        if not labels:
+            raise CommandError('Enter at least one occurrence model (app_label.ModelName).')
+        before = datetime.datetime.now() - datetime.timedelta(days=options['days'])
+        for label in labels:
+            try:
+                app_label, model_name = label.split('.')
+            except ValueError:
+                raise CommandError('Model should be given as app_label.ModelName, not %r.' % label)
+            model = get_model(app_label, model_name)
+            if model is None:
+                raise CommandError('Unknown model: %s' % label)
+            queryset = model._default_manager.all()
+            deleted = prune_occurrences(queryset, before, batch_size=options['batch_size'],
+                                        sleep=options['sleep'])
+            self.stdout.write('%s: deleted %i stale occurrences\n' % (label, deleted))
+            if options['orphans']:
+                deleted = delete_orphaned_occurrences(queryset, batch_size=options['batch_size'],
+                                                      sleep=options['sleep'])
+                self.stdout.write('%s: deleted %i orphaned occurrences\n' % (label, deleted))
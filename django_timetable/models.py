@@ -1,12 +1,38 @@
 from dateutil import rrule
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 
 from .abstract import AbstractMixin
 
 
+class OccurrenceSeriesQuerySet(models.query.QuerySet):
+    def overlapping(self, period_start, period_end=None):
+        """
+        Narrows series to these which can produce occurrence in given period
+        (according to their rules - moved occurrences are not taken into account).
+        Series without precomputed bounds are always returned.
+        """
+        query = Q(last_occurrence_end__gte=period_start)
+        if period_end is not None:
+            query &= Q(first_occurrence_start__lte=period_end)
+        return self.filter(query | Q(first_occurrence_start__isnull=True)
+                                 | Q(last_occurrence_end__isnull=True))
+
+
+class OccurrenceSeriesManager(models.Manager):
+    use_for_related_fields = True
+
+    def get_query_set(self):
+        return OccurrenceSeriesQuerySet(self.model, using=self._db)
+    get_queryset = get_query_set
+
+    def overlapping(self, period_start, period_end=None):
+        return self.get_query_set().overlapping(period_start, period_end)
+
+
 class OccurrenceSeriesFactory(models.Model, AbstractMixin):
     start = models.DateTimeField(_('start'))
     end = models.DateTimeField(_('end'))
@@ -14,6 +40,13 @@ class OccurrenceSeriesFactory(models.Model, AbstractMixin):
         _('end recurring period'), blank=True, null=True,
         help_text=_('This date is ignored for one time only events.')
     )
+    # bounds of all series occurrences - maintained on save
+    first_occurrence_start = models.DateTimeField(_('first occurrence start'), editable=False,
+                                                  null=True, db_index=True)
+    last_occurrence_end = models.DateTimeField(_('last occurrence end'), editable=False,
+                                               null=True, db_index=True)
+
+    objects = OccurrenceSeriesManager()
 
     class Meta:
         abstract = True
@@ -33,15 +66,114 @@ class OccurrenceSeriesFactory(models.Model, AbstractMixin):
         existing_occurrences = set(existing_occurrences)
         missing = filter(lambda start: start not in existing_occurrences,
                          all_occurrences)
-        delta = self.end - self.start
         for s in missing:
-            result.append(occurrence_model(
-                event=self,
-                original_start=s, start=s,
-                original_end=s+delta, end=s+delta, **defaults)
-            )
+            result.append(self._get_occurrence(s, occurrence_model, **defaults))
         return result
 
+    def _get_occurrence(self, start, occurrence_model=None, **defaults):
+        occurrence_model = occurrence_model or self.occurrences.model
+        delta = self.end - self.start
+        return occurrence_model(event=self,
+                                original_start=start, start=start,
+                                original_end=start+delta, end=start+delta,
+                                **defaults)
+
+    def _insert_ignoring_conflicts(self, occurrences, occurrence_model, using):
+        """
+        Inserts occurrences with one query per batch skipping these which
+        violate (event, original_start) uniqueness. Returns False when
+        database backend doesn't support it.
+        """
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        opts = occurrence_model._meta
+        fields = [f for f in opts.local_fields if not isinstance(f, models.AutoField)]
+        columns = ', '.join(qn(f.column) for f in fields)
+        if connection.vendor == 'postgresql':
+            sql = 'INSERT INTO %s (%s) VALUES %%s ON CONFLICT (%s, %s) DO NOTHING' % (
+                qn(opts.db_table), columns,
+                qn(opts.get_field('event').column), qn(opts.get_field('original_start').column))
+        elif connection.vendor == 'sqlite':
+            sql = 'INSERT OR IGNORE INTO %s (%s) VALUES %%s' % (qn(opts.db_table), columns)
+        else:
+            return False
+        placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+        batch_size = max(connection.ops.bulk_batch_size(fields, occurrences), 1)
+        cursor = connection.cursor()
+        for i in range(0, len(occurrences), batch_size):
+            batch = occurrences[i:i+batch_size]
+            params = []
+            for occurrence in batch:
+                params.extend(f.get_db_prep_save(f.pre_save(occurrence, True), connection=connection)
+                              for f in fields)
+            cursor.execute(sql % ', '.join([placeholders] * len(batch)), params)
+        if not hasattr(transaction, 'atomic'):
+            transaction.commit_unless_managed(using=using)
+        return True
+
+    def _insert_occurrences(self, occurrences, occurrence_model):
+        """
+        Idempotent insert - occurrences which were already stored (for example
+        by concurrent request) are skipped thanks to (event, original_start)
+        uniqueness (INSERT ... ON CONFLICT DO NOTHING where backend supports
+        it). Any other error is raised. Returns stored versions of all given
+        occurrences.
+        """
+        manager = occurrence_model._default_manager
+        using = router.db_for_write(occurrence_model)
+        error = None
+        if not self._insert_ignoring_conflicts(occurrences, occurrence_model, using):
+            for occurrence in occurrences:
+                sid = transaction.savepoint(using=using)
+                try:
+                    occurrence.save(force_insert=True, using=using)
+                except IntegrityError as e:
+                    error = e
+                    transaction.savepoint_rollback(sid, using=using)
+                else:
+                    transaction.savepoint_commit(sid, using=using)
+        starts = set(o.original_start for o in occurrences)
+        stored = [o for o in manager.filter(event=self,
+                                            original_start__gte=min(starts),
+                                            original_start__lte=max(starts))
+                  if o.original_start in starts]
+        if len(stored) < len(starts):
+            # something else than duplicate prevented insert
+            if error is not None:
+                raise error
+            stored_starts = set(o.original_start for o in stored)
+            for occurrence in occurrences:
+                if occurrence.original_start not in stored_starts:
+                    # raises original database error
+                    occurrence.save(force_insert=True, using=using)
+                    stored.append(occurrence)
+        return stored
+
+    def _get_starts(self, after=None):
+        """
+        Lazy iterator over occurrence starts of this series (starting at
+        `after` if given). Dateutil ignores microseconds, so they are dropped
+        here too. For rules with constant step expansion begins directly at
+        the first start after `after` instead of series start.
+        """
+        start = self.start.replace(microsecond=0)
+        if self.rule == None:
+            starts = [start]
+        elif self.end_recurring_period is None:
+            starts = []
+        else:
+            step = getattr(self.rule, 'get_step', lambda: None)()
+            if after is not None and after > start and step:
+                distance = after - start
+                distance = distance.days*86400 + distance.seconds + (1 if distance.microseconds else 0)
+                step_seconds = step.days*86400 + step.seconds
+                start += step * (-(-distance // step_seconds))
+            starts = self.rule(period_start=start,
+                               period_end=self.end_recurring_period.replace(microsecond=0))
+        if after is None:
+            return iter(starts)
+        return (s for s in starts if s >= after)
+
     def get_occurrences(self, period_start=None, period_end=None,
                         commit=False, defaults=None, queryset=None):
         defaults = defaults or {}
@@ -65,19 +197,30 @@ class OccurrenceSeriesFactory(models.Model, AbstractMixin):
             starts = [start]
         result = list(queryset.filter(original_start__lte=period_end,
                                       original_end__gte=period_start))
-        if len(result) != len(starts):
-            existing = queryset.filter(original_start__lte=period_end,
-                                       original_end__gte=period_start).values_list('original_start',
-                                                                                   flat=True)
-            result.extend(self._get_missing_occurrences(starts, existing,
-                                                        occurrence_model=occurrence_model,
-                                                        **defaults))
-            if commit:
-                for occurrence in result:
-                    occurrence.save()
+        missing = self._get_missing_occurrences(starts, [o.original_start for o in result],
+                                                occurrence_model=occurrence_model,
+                                                **defaults)
+        if missing and commit:
+            result.extend(self._insert_occurrences(missing, occurrence_model))
+        else:
+            result.extend(missing)
         result.sort(lambda o1, o2: cmp(o1.start, o2.start))
         return result
 
+    def _update_bounds(self):
+        if self.start is None or self.end is None:
+            return
+        self.first_occurrence_start = self.start
+        if self.rule == None or self.end_recurring_period is None:
+            self.last_occurrence_end = self.end
+        else:
+            # last occurrence starts before end of recurring period
+            self.last_occurrence_end = self.end_recurring_period + (self.end - self.start)
+
+    def save(self, *args, **kwargs):
+        self._update_bounds()
+        super(OccurrenceSeriesFactory, self).save(*args, **kwargs)
+
     def clean(self):
         if self.start and self.end and self.start > self.end:
             raise ValidationError(_("Start value can't be greater then end value."))
@@ -96,6 +239,7 @@ class OccurrenceFactory(models.Model, AbstractMixin):
     class Meta:
         abstract = True
         ordering = ('start',)
+        unique_together = (('event', 'original_start'),)
 
     @classmethod
     def contribute(cls, event):
@@ -0,0 +1,127 @@
+import datetime
+
+from django.db import models
+from django.db.models import Q
+from django.db.models.query import QuerySet
+
+GRANULARITIES = (None, 'day', 'week', 'month')
+
+
+def _get_bucket(moment, granularity):
+    day = datetime.datetime(moment.year, moment.month, moment.day)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _get_next_bucket(bucket, granularity):
+    if granularity == 'day':
+        return bucket + datetime.timedelta(days=1)
+    if granularity == 'week':
+        return bucket + datetime.timedelta(weeks=1)
+    if bucket.month == 12:
+        return bucket.replace(year=bucket.year+1, month=1)
+    return bucket.replace(month=bucket.month+1)
+
+
+def _split(start, end, granularity):
+    """
+    Yields (bucket, duration) pairs for all buckets which given time span touches.
+    """
+    if granularity is None:
+        yield None, end - start
+        return
+    bucket = _get_bucket(start, granularity)
+    while True:
+        next_bucket = _get_next_bucket(bucket, granularity)
+        if end <= next_bucket:
+            yield bucket, end - start
+            return
+        yield bucket, next_bucket - start
+        start = bucket = next_bucket
+
+
+def get_series_queryset(series):
+    """
+    Returns queryset of series given as calendar (object with `events`
+    relation), manager or queryset.
+    """
+    if isinstance(series, models.Manager):
+        return series.all()
+    if not isinstance(series, QuerySet):
+        return series.events.all()
+    return series
+
+
+def get_persisted_occurrences(series, period_start, period_end):
+    """
+    Returns queryset of stored occurrences of given series which touch given
+    period - by their current or original position (the latter are needed to
+    skip generated occurrences which were stored and moved elsewhere).
+    Occurrences are not limited to series returned by `overlapping`, so
+    these moved beyond their series bounds are included too.
+    """
+    occurrence_model = series.model.occurrences.related.model
+    return occurrence_model._default_manager.filter(event__in=series)\
+            .filter(Q(start__lt=period_end, end__gte=period_start)
+                    | Q(original_start__lt=period_end, original_end__gte=period_start))
+
+
+def get_overlapping_series(series, period_start, period_end):
+    if hasattr(series, 'overlapping'):
+        return series.overlapping(period_start, period_end)
+    return series
+
+
+def overlaps(start, end, period_start, period_end):
+    return start < period_end and (end > period_start or start >= period_start)
+
+
+def get_occupancy(series, period_start, period_end, granularity='day', group_by=None):
+    """
+    Computes occurrences count and occupied time in given period per bucket
+    (day, week, month or None for whole period) for calendar (object with
+    `events` relation) or series queryset. When group_by (series field name,
+    for example 'calendar') is given results are keyed by (group, bucket)
+    pairs instead of buckets.
+
+    Returns dict which maps keys to {'count': ..., 'duration': ...} dicts.
+    Persisted occurrences are read as plain values (one query) and not
+    persisted ones are computed from series rules - expansion starts at the
+    period (see BaseRruleValue.get_step) and no occurrence instances are
+    created.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError("Unknown granularity: %r (choices: %r)" % (granularity, GRANULARITIES))
+    series = get_series_queryset(series)
+
+    result = {}
+    def add(group, start, end):
+        start, end = max(start, period_start), min(end, period_end)
+        for bucket, duration in _split(start, end, granularity):
+            key = bucket if group_by is None else (group, bucket)
+            usage = result.setdefault(key, {'count': 0, 'duration': datetime.timedelta()})
+            usage['count'] += 1
+            usage['duration'] += duration
+
+    group_lookup = 'event' if group_by is None else 'event__%s' % group_by
+    persisted = set()
+    rows = get_persisted_occurrences(series, period_start, period_end)\
+            .values_list('event', group_lookup, 'original_start', 'start', 'end')
+    for event_id, group, original_start, start, end in rows:
+        persisted.add((event_id, original_start))
+        if overlaps(start, end, period_start, period_end):
+            add(group, start, end)
+
+    for s in get_overlapping_series(series, period_start, period_end):
+        delta = s.end - s.start
+        group = getattr(s, s._meta.get_field(group_by).attname) if group_by is not None else None
+        for start in s._get_starts(period_start - delta):
+            if start >= period_end:
+                break
+            if (s.pk, start) in persisted or not overlaps(start, start+delta, period_start, period_end):
+                continue
+            add(group, start, start+delta)
+    return result
@@ -0,0 +1,186 @@
+import contextlib
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router, transaction
+
+DEFAULT_CALENDAR_LOCK = 'django_timetable.sequential_calendar.locks.SelectForUpdateLock'
+
+
+@contextlib.contextmanager
+def _join_transaction():
+    yield
+
+
+def _atomic(using):
+    if hasattr(transaction, 'atomic'):
+        return transaction.atomic(using=using)
+    if transaction.is_managed(using=using):
+        # commit_on_success would commit outer transaction (and release
+        # database locks) on exit, so we join it instead
+        return _join_transaction()
+    return transaction.commit_on_success(using=using)
+
+
+def _in_transaction(using):
+    if hasattr(transaction, 'atomic'):
+        return connections[using].in_atomic_block
+    return transaction.is_managed(using=using)
+
+
+# calendars locked by non transactional locks in current thread
+_held = threading.local()
+
+def _get_held():
+    if not hasattr(_held, 'keys'):
+        _held.keys = set()
+    return _held.keys
+
+
+def _get_label(calendar):
+    return '%s.%s' % (calendar._meta.app_label, calendar._meta.object_name)
+
+
+class BaseCalendarLock(object):
+    """
+    Serializes writes to one calendar. Transactional locks are acquired
+    inside database transaction and released on its end. Other locks open
+    their own transaction and are released after it is committed (or rolled
+    back) - they can't be used inside already open transaction (for example
+    with TransactionMiddleware), because they would be released before
+    enclosing transaction commits.
+    """
+    transactional = False
+
+    def acquire(self, calendar, using):
+        raise NotImplementedError
+
+    def release(self, calendar, using):
+        pass
+
+
+class SelectForUpdateLock(BaseCalendarLock):
+    """
+    Locks calendar row (backends without SELECT ... FOR UPDATE support,
+    like sqlite, ignore it).
+    """
+    transactional = True
+
+    def acquire(self, calendar, using):
+        manager = calendar.__class__._default_manager
+        list(manager.using(using).select_for_update().filter(pk=calendar.pk).values_list('pk', flat=True))
+
+
+class AdvisoryLock(BaseCalendarLock):
+    """
+    PostgreSQL transaction level advisory lock - doesn't touch calendar row.
+    Lock key is a signed 64bit hash of calendar model and primary key (so any
+    pk type fits) - hash collision can only serialize two calendars.
+    """
+    transactional = True
+
+    def _get_key(self, calendar):
+        digest = hashlib.md5(('%s:%s' % (_get_label(calendar), calendar.pk)).encode('utf-8')).digest()
+        return struct.unpack('>q', digest[:8])[0]
+
+    def acquire(self, calendar, using):
+        cursor = connections[using].cursor()
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [self._get_key(calendar)])
+
+
+class ThreadingLock(BaseCalendarLock):
+    """
+    Process local fallback - serializes only threads of one process.
+    """
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+    def _get_lock(self, calendar):
+        key = (_get_label(calendar), calendar.pk)
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.RLock())
+
+    def acquire(self, calendar, using):
+        self._get_lock(calendar).acquire()
+
+    def release(self, calendar, using):
+        self._get_lock(calendar).release()
+
+
+class FileLock(BaseCalendarLock):
+    """
+    Host local fallback - serializes processes of one host with flock(2)
+    on files from TIMETABLE_CALENDAR_LOCK_DIR (system temp dir by default).
+    """
+    def __init__(self):
+        self._files = {}
+
+    def _get_path(self, calendar):
+        directory = getattr(settings, 'TIMETABLE_CALENDAR_LOCK_DIR', tempfile.gettempdir())
+        return os.path.join(directory, 'timetable-%s-%s.lock' % (_get_label(calendar), calendar.pk))
+
+    def acquire(self, calendar, using):
+        import fcntl
+        lock_file = open(self._get_path(calendar), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        self._files.setdefault((_get_label(calendar), calendar.pk), []).append(lock_file)
+
+    def release(self, calendar, using):
+        import fcntl
+        lock_file = self._files[(_get_label(calendar), calendar.pk)].pop()
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def get_calendar_lock():
+    path = getattr(settings, 'TIMETABLE_CALENDAR_LOCK', DEFAULT_CALENDAR_LOCK)
+    module_name, _, class_name = path.rpartition('.')
+    try:
+        return getattr(import_module(module_name), class_name)()
+    except (ImportError, AttributeError, ValueError):
+        raise ImproperlyConfigured('Invalid TIMETABLE_CALENDAR_LOCK: %r' % path)
+
+
+@contextlib.contextmanager
+def calendar_lock(calendar, lock=None, using=None):
+    """
+    Runs enclosed block in transaction holding lock of given calendar, so
+    collision checks and writes to one calendar are serialized while writes
+    to different calendars proceed in parallel. Lock backend can be set
+    with TIMETABLE_CALENDAR_LOCK setting (dotted path to BaseCalendarLock
+    subclass). When transaction is already open (nested calendar_lock for
+    example) transactional locks join it and are held until it ends. Non
+    transactional locks raise TransactionManagementError in such case
+    (unless calendar is already locked by enclosing calendar_lock).
+    """
+    lock = lock or get_calendar_lock()
+    using = using or router.db_for_write(calendar.__class__)
+    if lock.transactional:
+        with _atomic(using):
+            lock.acquire(calendar, using)
+            yield
+        return
+    key = (_get_label(calendar), calendar.pk, using)
+    held = _get_held()
+    if key in held:
+        # enclosing calendar_lock releases lock after its transaction ends
+        yield
+        return
+    if _in_transaction(using):
+        raise transaction.TransactionManagementError(
+            "%s can't be used inside open transaction - it would be released "
+            "before the transaction is committed." % lock.__class__.__name__)
+    lock.acquire(calendar, using)
+    held.add(key)
+    try:
+        with _atomic(using):
+            yield
+    finally:
+        held.discard(key)
+        lock.release(calendar, using)
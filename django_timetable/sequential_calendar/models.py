@@ -7,12 +7,13 @@ from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 
 from ..models import OccurrenceSeriesFactory, OccurrenceFactory
+from .locks import calendar_lock
 
 class TimeColisionError(ValidationError):
     pass
 
 class CalendarOccurrenceSeriesFactory(OccurrenceSeriesFactory):
-    class Meta:
+    class Meta(OccurrenceSeriesFactory.Meta):
         abstract = True
 
     @classmethod
@@ -26,7 +27,7 @@ class CalendarOccurrenceSeriesFactory(OccurrenceSeriesFactory):
         return fields
 
 class SequentialOccurrenceSeriesFactory(CalendarOccurrenceSeriesFactory):
-    class Meta:
+    class Meta(CalendarOccurrenceSeriesFactory.Meta):
         abstract = True
 
     def update_recurring_period(self, new_end, defaults=None):
@@ -38,6 +39,19 @@ class SequentialOccurrenceSeriesFactory(CalendarOccurrenceSeriesFactory):
                              commit=True, defaults=defaults)
         self.occurrences.filter(start__gt=self.end_recurring_period).delete()
 
+    def save_with_lock(self, *args, **kwargs):
+        """
+        Validates, saves and materializes series occurrences holding its
+        calendar lock, so no other write to this calendar can interleave
+        (see locks.calendar_lock). Collisions are checked against stored
+        occurrences, so they have to be stored before the lock is released.
+        """
+        defaults = kwargs.pop('defaults', None)
+        with calendar_lock(self.calendar):
+            self.full_clean()
+            self.save(*args, **kwargs)
+            self.get_occurrences(commit=True, defaults=defaults)
+
     def _get_collision_query(self, occurrence):
         subquery = (Q(occurrences__start__gte=occurrence.start) & Q(occurrences__start__lt=occurrence.end)) \
                 | (Q(occurrences__start__lte=occurrence.start) & Q(occurrences__end__gt=occurrence.start))
@@ -74,10 +88,71 @@ class SequentialOccurrenceSeriesFactory(CalendarOccurrenceSeriesFactory):
                 params=self.calendar.events.filter(query).order_by('start')[0],
             )
 
+def _collide(start, end, other_start, other_end):
+    return (other_start >= start and other_start < end) \
+            or (other_start <= start and other_end > start)
+
 class SequentialOccurrenceFactory(OccurrenceFactory):
-    class Meta:
+    class Meta(OccurrenceFactory.Meta):
         abstract = True
 
+    @classmethod
+    def validate_collisions(cls, occurrences):
+        """
+        Batch version of collision validation (usable with formsets). Checks
+        all given (saved or not) occurrences against each other and against
+        stored occurrences from their calendars - stored occurrences window
+        is loaded with one query and checked in one sorted sweep.
+        Returns list of errors (TimeColisionError or None) in occurrences order.
+        """
+        errors = [None] * len(occurrences)
+        checked = [(index, o) for index, o in enumerate(occurrences) if o.start and o.end]
+        if not checked:
+            return errors
+        event_model = cls._meta.get_field('event').rel.to
+        event2calendar = dict(event_model._default_manager.filter(pk__in=set(o.event_id for i, o in checked
+                                                                            if o.event_id is not None))
+                                                          .values_list('pk', 'calendar'))
+        edited = set(o.pk for i, o in checked if o.pk)
+        period_start = min(o.start for i, o in checked)
+        period_end = max(o.end for i, o in checked)
+
+        calendar2items = {}
+        for index, o in checked:
+            # not saved series are not in the database
+            calendar = event2calendar.get(o.event_id) or o.event.calendar_id
+            calendar2items.setdefault(calendar, []).append((o.start, o.end, index))
+        stored = cls._default_manager.filter(event__calendar__in=list(calendar2items.keys()),
+                                             start__lte=period_end, end__gte=period_start)\
+                                     .values_list('pk', 'event__calendar', 'start', 'end')
+        for pk, calendar, start, end in stored:
+            if pk not in edited:
+                calendar2items[calendar].append((start, end, None))
+
+        for items in calendar2items.values():
+            items.sort(key=lambda item: item[0])
+            active = []
+            for start, end, index in items:
+                # only items ending after current start (or starting with it) can collide
+                active = [a for a in active if a[1] > start or a[0] == start]
+                for a_start, a_end, a_index in active:
+                    if (index is None and a_index is None) or not _collide(a_start, a_end, start, end):
+                        continue
+                    for i in (index, a_index):
+                        if i is not None and errors[i] is None:
+                            errors[i] = TimeColisionError(_("Occurrence has time collision with other occurrence from this calendar."))
+                active.append((start, end, index))
+        return errors
+
+    def save_with_lock(self, *args, **kwargs):
+        """
+        Validates and saves occurrence holding its calendar lock, so no other
+        write to this calendar can interleave (see locks.calendar_lock).
+        """
+        with calendar_lock(self.event.calendar):
+            self.full_clean()
+            self.save(*args, **kwargs)
+
     def clean(self):
         super(SequentialOccurrenceFactory, self).clean()
         if self.id:
@@ -3,11 +3,14 @@ from dateutil import rrule
 
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from django.db import models
-from django.test import TestCase
+from django.db import models, transaction
+from django.test import TestCase, TransactionTestCase
 
 from .models import SequentialOccurrenceSeriesFactory, SequentialOccurrenceFactory
+from .locks import calendar_lock, SelectForUpdateLock, ThreadingLock
 from ..fields import ComplexRruleField
+from ..grid import build_grid
+from ..occupancy import get_occupancy
 
 RRULES_CHOICES = (
     ('', 'once',),
@@ -63,6 +66,11 @@ class Models(TestCase):
         event.update_recurring_period(new_end)
         self.assertEqual(event.occurrences.count(), len(list(rrule.rrule(dtstart=now, until=new_end, freq=rrule.DAILY))))
 
+    def test_sequential_factories_inherit_base_meta_options(self):
+        self.assertEqual(Occurrence._meta.unique_together, (('event', 'original_start'),))
+        self.assertEqual(Occurrence._meta.ordering, ('start',))
+        self.assertEqual(OccurrenceSeries._meta.ordering, ('start',))
+
     def test_add_event_fails_for_occurrences_time_collision(self):
         now = datetime.datetime.now()
         end_recurring = now + datetime.timedelta(days=3)
@@ -139,3 +147,215 @@ class Models(TestCase):
         )
         event.save()
         event.get_occurrences(commit=True)
+
+    def test_update_recurring_period_updates_series_bounds(self):
+        event = OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            end_recurring_period=self.now+datetime.timedelta(weeks=1),
+            calendar=self.user_test, rule='DAILY'
+        )
+        new_end = self.now + datetime.timedelta(weeks=2)
+        event.update_recurring_period(new_end)
+        event = OccurrenceSeries.objects.get(pk=event.pk)
+        self.assertEqual(event.last_occurrence_end, new_end+datetime.timedelta(hours=1))
+        self.assertEqual(list(self.user_test.events.overlapping(new_end, new_end)), [event])
+
+    def test_validate_collisions_checks_occurrences_against_stored_ones(self):
+        event = OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            end_recurring_period=self.now+datetime.timedelta(days=3),
+            calendar=self.user_test, rule='DAILY'
+        )
+        occurrences = event.get_occurrences(commit=True)
+        moved = occurrences[0]
+        moved.start = occurrences[1].start + datetime.timedelta(minutes=30)
+        moved.end = moved.start + datetime.timedelta(hours=1)
+        untouched = occurrences[2]
+        errors = Occurrence.validate_collisions([moved, untouched])
+        self.assertTrue(isinstance(errors[0], ValidationError))
+        self.assertEqual(errors[1], None)
+
+    def test_validate_collisions_checks_edited_occurrences_against_each_other(self):
+        event = OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            end_recurring_period=self.now+datetime.timedelta(days=3),
+            calendar=self.user_test, rule='DAILY'
+        )
+        occurrences = event.get_occurrences(commit=True)
+        target = self.now + datetime.timedelta(hours=5)
+        occurrences[0].start, occurrences[0].end = target, target+datetime.timedelta(hours=1)
+        occurrences[1].start, occurrences[1].end = target, target+datetime.timedelta(hours=2)
+        new = Occurrence(event=event, original_start=target, original_end=target,
+                         start=target+datetime.timedelta(hours=3), end=target+datetime.timedelta(hours=4))
+        errors = Occurrence.validate_collisions([occurrences[0], occurrences[1], new])
+        self.assertTrue(isinstance(errors[0], ValidationError))
+        self.assertTrue(isinstance(errors[1], ValidationError))
+        self.assertEqual(errors[2], None)
+
+    def test_validate_collisions_accepts_occurrences_of_not_saved_series(self):
+        stored = OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            calendar=self.user_test, rule=''
+        )
+        stored.get_occurrences(commit=True)
+        event = OccurrenceSeries(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            calendar=self.user_test, rule=''
+        )
+        occurrence = event.get_occurrences()[0]
+        self.assertTrue(isinstance(Occurrence.validate_collisions([occurrence])[0], ValidationError))
+
+    def test_validate_collisions_ignores_occurrences_without_times(self):
+        event = OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            end_recurring_period=self.now+datetime.timedelta(days=3),
+            calendar=self.user_test, rule='DAILY'
+        )
+        occurrences = event.get_occurrences(commit=True)
+        blank = occurrences[0]
+        blank.start = blank.end = None
+        moved = occurrences[1]
+        moved.start = self.now + datetime.timedelta(minutes=30)
+        moved.end = moved.start + datetime.timedelta(hours=1)
+        # stored version of blank occurrence is still checked against
+        self.assertEqual(Occurrence.validate_collisions([blank, moved])[0], None)
+        self.assertTrue(isinstance(Occurrence.validate_collisions([blank, moved])[1], ValidationError))
+
+    def test_occupancy_sums_generated_and_persisted_occurrences_per_day(self):
+        day = datetime.datetime(self.now.year, self.now.month, self.now.day)
+        event = OccurrenceSeries.objects.create(start=day+datetime.timedelta(hours=10),
+            end=day+datetime.timedelta(hours=11),
+            end_recurring_period=day+datetime.timedelta(days=2, hours=10),
+            calendar=self.user_test, rule='DAILY'
+        )
+        # only first occurrence is persisted
+        occurrence = event.get_occurrences(period_end=day+datetime.timedelta(hours=10), commit=True)[0]
+        occurrence.end = occurrence.end + datetime.timedelta(hours=1)
+        occurrence.save()
+        occupancy = get_occupancy(self.user_test, day, day+datetime.timedelta(days=3))
+        self.assertEqual(sorted(occupancy.keys()),
+                         [day+datetime.timedelta(days=d) for d in range(3)])
+        self.assertEqual(occupancy[day], {'count': 1, 'duration': datetime.timedelta(hours=2)})
+        self.assertEqual(occupancy[day+datetime.timedelta(days=1)],
+                         {'count': 1, 'duration': datetime.timedelta(hours=1)})
+
+        occupancy = get_occupancy(OccurrenceSeries.objects.all(), day, day+datetime.timedelta(days=3),
+                                  granularity=None, group_by='calendar')
+        self.assertEqual(occupancy, {(self.user_test.pk, None): {'count': 3,
+                                                                'duration': datetime.timedelta(hours=4)}})
+
+    def test_occupancy_counts_occurrence_moved_beyond_series_bounds(self):
+        day = datetime.datetime(self.now.year, self.now.month, self.now.day)
+        event = OccurrenceSeries.objects.create(start=day+datetime.timedelta(hours=10),
+            end=day+datetime.timedelta(hours=11),
+            calendar=self.user_test, rule=''
+        )
+        occurrence = event.get_occurrences(commit=True)[0]
+        occurrence.start = day + datetime.timedelta(days=5, hours=10)
+        occurrence.end = day + datetime.timedelta(days=5, hours=12)
+        occurrence.save()
+        occupancy = get_occupancy(self.user_test, day+datetime.timedelta(days=5),
+                                  day+datetime.timedelta(days=6))
+        self.assertEqual(occupancy, {day+datetime.timedelta(days=5): {'count': 1,
+                                                                      'duration': datetime.timedelta(hours=2)}})
+
+    def test_save_with_lock_validates_and_saves_series(self):
+        event = OccurrenceSeries(start=self.now, end=self.now+datetime.timedelta(hours=1),
+            end_recurring_period=self.now+datetime.timedelta(days=3),
+            calendar=self.user_test, rule='DAILY'
+        )
+        event.save_with_lock()
+        colliding = OccurrenceSeries(start=self.now+datetime.timedelta(minutes=30),
+            end=self.now+datetime.timedelta(hours=2),
+            calendar=self.user_test, rule=''
+        )
+        self.assertRaises(ValidationError, colliding.save_with_lock)
+        self.assertEqual(self.user_test.events.count(), 1)
+
+    def test_save_with_lock_rejects_identical_onetime_series(self):
+        OccurrenceSeries(start=self.now, end=self.now+datetime.timedelta(hours=1),
+                         calendar=self.user_test, rule='').save_with_lock()
+        event = OccurrenceSeries(start=self.now, end=self.now+datetime.timedelta(hours=1),
+                                 calendar=self.user_test, rule='')
+        self.assertRaises(ValidationError, event.save_with_lock)
+        self.assertEqual(self.user_test.events.count(), 1)
+        self.assertEqual(Occurrence.objects.count(), 1)
+
+    def test_non_transactional_calendar_lock_refuses_open_transaction(self):
+        # test case runs inside managed transaction
+        def lock():
+            with calendar_lock(self.user_test, lock=ThreadingLock()):
+                pass
+        self.assertRaises(transaction.TransactionManagementError, lock)
+
+    def test_grid_references_occurrences_from_touched_cells_and_assigns_lanes(self):
+        day = datetime.datetime(self.now.year, self.now.month, self.now.day)
+        daily = OccurrenceSeries.objects.create(start=day+datetime.timedelta(hours=10),
+            end=day+datetime.timedelta(hours=11),
+            end_recurring_period=day+datetime.timedelta(days=1, hours=10),
+            calendar=self.user_test, rule='DAILY'
+        )
+        # stored directly - overlapping series don't pass validation
+        overnight = OccurrenceSeries.objects.create(start=day+datetime.timedelta(hours=9),
+            end=day+datetime.timedelta(days=1, hours=1),
+            calendar=self.user_test, rule=''
+        )
+        grid = build_grid(self.user_test, day, day+datetime.timedelta(days=2), granularity='day')
+        self.assertEqual(len(grid.cells), 2)
+        self.assertEqual(grid.lanes, 2)
+        self.assertEqual([(o.event, lane) for o, lane in grid.cells[0].entries],
+                         [(overnight, 0), (daily, 1)])
+        # lane 0 is free again when second daily occurrence starts
+        self.assertEqual([(o.event, lane) for o, lane in grid.cells[1].entries],
+                         [(overnight, 0), (daily, 0)])
+
+        grid = build_grid(self.user_test, day, day+datetime.timedelta(days=1), granularity='hour')
+        self.assertEqual(len(grid.cells), 24)
+        self.assertEqual([len(cell.entries) for cell in grid.cells[8:12]], [0, 1, 2, 1])
+
+    def test_grid_contains_occurrence_running_into_period_from_previous_day(self):
+        day = datetime.datetime(self.now.year, self.now.month, self.now.day)
+        # daily 22:00 - 02:00
+        OccurrenceSeries.objects.create(start=day-datetime.timedelta(days=1, hours=2),
+            end=day-datetime.timedelta(hours=22),
+            end_recurring_period=day+datetime.timedelta(days=2),
+            calendar=self.user_test, rule='DAILY'
+        )
+        with self.assertNumQueries(2):
+            grid = build_grid(self.user_test, day, day+datetime.timedelta(days=1), granularity='hour')
+        self.assertEqual([len(cell.entries) for cell in grid.cells[:3]], [1, 1, 0])
+        self.assertEqual([len(cell.entries) for cell in grid.cells[21:]], [0, 1, 1])
+        occupancy = get_occupancy(self.user_test, day, day+datetime.timedelta(days=1), granularity=None)
+        self.assertEqual(occupancy[None], {'count': 2, 'duration': datetime.timedelta(hours=4)})
+
+    def test_grid_keeps_zero_length_occurrence_lane_until_next_start(self):
+        start = datetime.datetime(self.now.year, self.now.month, self.now.day, 10)
+        OccurrenceSeries.objects.create(start=start, end=start, calendar=self.user_test, rule='')
+        OccurrenceSeries.objects.create(start=start, end=start+datetime.timedelta(hours=1),
+                                        calendar=self.user_test, rule='')
+        grid = build_grid(self.user_test, start, start+datetime.timedelta(hours=1), granularity='hour')
+        self.assertEqual(grid.lanes, 2)
+        self.assertEqual(sorted(lane for o, lane in grid.cells[0].entries), [0, 1])
+
+
+class CalendarLockTransactions(TransactionTestCase):
+    def setUp(self):
+        self.user_test = User.objects.create_user(
+                username='test', password='test', email='test@example.com'
+        )
+        self.now = datetime.datetime.now().replace(microsecond=0)
+
+    def _create_and_rollback(self, lock):
+        with calendar_lock(self.user_test, lock=lock):
+            with calendar_lock(self.user_test, lock=lock):
+                OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+                                                calendar=self.user_test, rule='')
+            # nested lock didn't end outer transaction
+            transaction.rollback()
+
+    def test_nested_calendar_lock_keeps_outer_transaction_open(self):
+        self._create_and_rollback(SelectForUpdateLock())
+        self.assertEqual(self.user_test.events.count(), 0)
+
+    def test_nested_non_transactional_calendar_lock_keeps_outer_transaction_open(self):
+        self._create_and_rollback(ThreadingLock())
+        self.assertEqual(self.user_test.events.count(), 0)
+        with calendar_lock(self.user_test, lock=ThreadingLock()):
+            with calendar_lock(self.user_test, lock=ThreadingLock()):
+                OccurrenceSeries.objects.create(start=self.now, end=self.now+datetime.timedelta(hours=1),
+                                                calendar=self.user_test, rule='')
+        self.assertEqual(self.user_test.events.count(), 1)
@@ -1,13 +1,18 @@
 import datetime
+from StringIO import StringIO
 from dateutil import rrule
 
 from django.core.exceptions import ValidationError
 from django import forms
-from django.db import models
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, models
 from django.test import TestCase
 
 from .models import OccurrenceSeriesFactory, OccurrenceFactory
 from .fields import RruleField, ComplexRruleField
+from .maintenance import prune_occurrences, delete_orphaned_occurrences
+from .timeline import get_timeline
 
 class OccurrenceSeriesWithRruleField(OccurrenceSeriesFactory.construct(rrule=RruleField(rrule.HOURLY,
                                                                                        blank=True, null=True))):
@@ -248,3 +253,191 @@ class Models(TestCase):
         self.assertEqual(len(occurrences_1), len(occurrences_3))
         self.assertEqual(occurrences_1, occurrences_3)
 
+
+    def test_get_occurrences_does_not_duplicate_concurrently_materialized_occurrences(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        event = OccurrenceSeriesWithRruleField.objects.create(start=now, end=now+datetime.timedelta(hours=1),
+                                                              end_recurring_period=now+datetime.timedelta(hours=5),
+                                                              rule=1)
+        occurrences_1 = event.get_occurrences(commit=True)
+        # empty queryset simulates concurrent request which didn't see stored occurrences
+        occurrences_2 = event.get_occurrences(commit=True, queryset=event.occurrences.none())
+        self.assertEqual(event.occurrences.count(), len(occurrences_1))
+        self.assertEqual(occurrences_1, occurrences_2)
+
+    def test_get_occurrences_inserts_missing_occurrences_with_one_query(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        event = OccurrenceSeriesWithRruleField.objects.create(start=now, end=now+datetime.timedelta(hours=1),
+                                                              end_recurring_period=now+datetime.timedelta(hours=23),
+                                                              rule=1)
+        # existing occurrences, insert and stored occurrences
+        with self.assertNumQueries(3):
+            occurrences = event.get_occurrences(commit=True)
+        self.assertEqual(len(occurrences), 24)
+        self.assertTrue(all(o.pk for o in occurrences))
+
+    def test_get_occurrences_raises_errors_other_than_duplicates(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        event = OccurrenceSeriesWithRruleField.objects.create(start=now, end=now+datetime.timedelta(hours=1),
+                                                              end_recurring_period=now+datetime.timedelta(hours=5),
+                                                              rule=1)
+        self.assertRaises(IntegrityError, lambda: event.get_occurrences(commit=True, defaults={'name': None}))
+
+    def test_get_starts_after_skips_to_first_start_in_window(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        series = [
+            OccurrenceSeriesWithRruleField(start=now, end=now+datetime.timedelta(hours=1),
+                                           end_recurring_period=now+datetime.timedelta(weeks=10),
+                                           rule=5),
+            OccurrenceSeriesWithComplexRruleField(start=now, end=now+datetime.timedelta(hours=1),
+                                                  end_recurring_period=now+datetime.timedelta(weeks=10),
+                                                  rule='EVERY_TWO_WEEKS'),
+            OccurrenceSeriesWithComplexRruleField(start=now, end=now+datetime.timedelta(hours=1),
+                                                  end_recurring_period=now+datetime.timedelta(weeks=30),
+                                                  rule='LAST_DAY_OF_MONTH'),
+        ]
+        self.assertEqual([s.rule.get_step() for s in series],
+                         [datetime.timedelta(hours=5), datetime.timedelta(weeks=2), None])
+        for s in series:
+            for after in (now-datetime.timedelta(days=1), now, now+datetime.timedelta(days=20, microseconds=1),
+                          now+datetime.timedelta(weeks=4)):
+                self.assertEqual(list(s._get_starts(after)),
+                                 [start for start in s._get_starts() if start >= after])
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime.now().replace(microsecond=0)
+        self.series_1 = OccurrenceSeriesWithRruleField.objects.create(start=self.now,
+                                                                      end=self.now+datetime.timedelta(minutes=30),
+                                                                      end_recurring_period=self.now+datetime.timedelta(days=1),
+                                                                      rule=2)
+        self.series_2 = OccurrenceSeriesWithRruleField.objects.create(start=self.now+datetime.timedelta(hours=1),
+                                                                      end=self.now+datetime.timedelta(hours=2),
+                                                                      end_recurring_period=self.now+datetime.timedelta(days=1),
+                                                                      rule=2)
+
+    def test_timeline_merges_series_in_start_order(self):
+        occurrences, cursor = get_timeline(OccurrenceSeriesWithRruleField.objects.all(),
+                                           after=self.now, limit=4)
+        self.assertEqual([o.start for o in occurrences],
+                         [self.now+datetime.timedelta(hours=h) for h in range(4)])
+        self.assertEqual([o.event for o in occurrences],
+                         [self.series_1, self.series_2, self.series_1, self.series_2])
+        self.assertTrue(cursor is not None)
+
+    def test_timeline_cursor_returns_next_page(self):
+        series = OccurrenceSeriesWithRruleField.objects.all()
+        first_page, cursor = get_timeline(series, after=self.now, limit=3)
+        second_page, cursor = get_timeline(series, limit=3, cursor=cursor)
+        self.assertEqual([o.start for o in second_page],
+                         [self.now+datetime.timedelta(hours=h) for h in range(3, 6)])
+        all_occurrences, cursor = get_timeline(series, after=self.now, limit=100)
+        self.assertEqual(cursor, None)
+        self.assertEqual(len(all_occurrences),
+                         len(self.series_1.get_occurrences()) + len(self.series_2.get_occurrences()))
+
+    def test_timeline_returns_persisted_occurrence_in_place_of_generated_one(self):
+        occurrence = self.series_1.get_occurrences(commit=True, defaults={'name': 'name'})[0]
+        occurrence.start = occurrence.start + datetime.timedelta(hours=3, minutes=30)
+        occurrence.end = occurrence.end + datetime.timedelta(hours=3, minutes=30)
+        occurrence.save()
+        occurrences, cursor = get_timeline(OccurrenceSeriesWithRruleField.objects.all(),
+                                           after=self.now, limit=4)
+        self.assertEqual([o.start for o in occurrences],
+                         [self.now+datetime.timedelta(hours=h) for h in (1, 2, 3)] +
+                         [self.now+datetime.timedelta(hours=3, minutes=30)])
+        self.assertEqual(occurrences[-1].pk, occurrence.pk)
+
+    def test_timeline_returns_persisted_occurrence_moved_beyond_series_bounds(self):
+        past = OccurrenceSeriesWithRruleField.objects.create(start=self.now-datetime.timedelta(days=10),
+                                                             end=self.now-datetime.timedelta(days=10, hours=-1),
+                                                             rule=None)
+        occurrence = past.get_occurrences(commit=True, defaults={'name': 'name'})[0]
+        occurrence.start = self.now + datetime.timedelta(minutes=30)
+        occurrence.end = occurrence.start + datetime.timedelta(hours=1)
+        occurrence.save()
+        occurrences, cursor = get_timeline(OccurrenceSeriesWithRruleField.objects.filter(pk=past.pk),
+                                           after=self.now)
+        self.assertEqual(occurrences, [occurrence])
+        self.assertEqual(cursor, None)
+
+
+class SeriesBoundsTest(TestCase):
+    def test_save_updates_bounds_of_recurring_series(self):
+        now = datetime.datetime.now()
+        series = OccurrenceSeriesWithRruleField.objects.create(start=now, end=now+datetime.timedelta(hours=1),
+                                                               end_recurring_period=now+datetime.timedelta(days=1),
+                                                               rule=24)
+        self.assertEqual(series.first_occurrence_start, now)
+        self.assertEqual(series.last_occurrence_end, now+datetime.timedelta(days=1, hours=1))
+
+    def test_save_updates_bounds_of_onetime_series(self):
+        now = datetime.datetime.now()
+        series = OccurrenceSeriesWithRruleField.objects.create(start=now, end=now+datetime.timedelta(hours=1),
+                                                               end_recurring_period=now+datetime.timedelta(days=1),
+                                                               rule=None)
+        self.assertEqual(series.last_occurrence_end, now+datetime.timedelta(hours=1))
+
+    def test_overlapping_filters_series_by_period(self):
+        now = datetime.datetime.now()
+        past = OccurrenceSeriesWithRruleField.objects.create(start=now-datetime.timedelta(days=10),
+                                                             end=now-datetime.timedelta(days=10, hours=-1),
+                                                             end_recurring_period=now-datetime.timedelta(days=5),
+                                                             rule=24)
+        current = OccurrenceSeriesWithRruleField.objects.create(start=now-datetime.timedelta(days=1),
+                                                                end=now-datetime.timedelta(days=1, hours=-1),
+                                                                end_recurring_period=now+datetime.timedelta(days=5),
+                                                                rule=24)
+        future = OccurrenceSeriesWithRruleField.objects.create(start=now+datetime.timedelta(days=10),
+                                                               end=now+datetime.timedelta(days=10, hours=1),
+                                                               rule=None)
+        self.assertEqual(list(OccurrenceSeriesWithRruleField.objects.overlapping(now, now+datetime.timedelta(days=1))),
+                         [current])
+        self.assertEqual(list(OccurrenceSeriesWithRruleField.objects.overlapping(now)),
+                         [current, future])
+
+
+class MaintenanceTest(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime.now().replace(microsecond=0)
+        self.series = OccurrenceSeriesWithRruleField.objects.create(start=self.now-datetime.timedelta(days=10),
+                                                                    end=self.now-datetime.timedelta(days=10, hours=-1),
+                                                                    end_recurring_period=self.now,
+                                                                    rule=24)
+        self.occurrences = self.series.get_occurrences(commit=True, defaults={'name': 'name'})
+
+    def test_prune_deletes_only_not_modified_old_occurrences(self):
+        modified = self.occurrences[0]
+        modified.end = modified.end + datetime.timedelta(minutes=30)
+        modified.save()
+        deleted = prune_occurrences(Occurrence.objects.all(), self.now-datetime.timedelta(days=5),
+                                    batch_size=2)
+        # occurrences from days 10..6 ago are older than cutoff, one of them was modified
+        self.assertEqual(deleted, 4)
+        self.assertTrue(Occurrence.objects.filter(pk=modified.pk).exists())
+        self.assertEqual(self.series.occurrences.count(), len(self.occurrences) - 4)
+
+    def test_delete_orphaned_occurrences(self):
+        OccurrenceSeriesWithRruleField.objects.filter(pk=self.series.pk)\
+                .update(end_recurring_period=self.now-datetime.timedelta(days=3))
+        deleted = delete_orphaned_occurrences(Occurrence.objects.all())
+        self.assertEqual(deleted, 3)
+        self.assertEqual(self.series.occurrences.count(), len(self.occurrences) - 3)
+
+    def test_prune_occurrences_command(self):
+        OccurrenceSeriesWithRruleField.objects.filter(pk=self.series.pk)\
+                .update(end_recurring_period=self.now-datetime.timedelta(days=3))
+        output = StringIO()
+        call_command('prune_occurrences', 'django_timetable.Occurrence', days=5, orphans=True,
+                     batch_size=2, stdout=output)
+        self.assertEqual(output.getvalue(),
+                         'django_timetable.Occurrence: deleted 5 stale occurrences\n'
+                         'django_timetable.Occurrence: deleted 3 orphaned occurrences\n')
+        self.assertEqual(self.series.occurrences.count(), len(self.occurrences) - 8)
+
+    def test_prune_occurrences_command_rejects_invalid_labels(self):
+        self.assertRaises(CommandError, call_command, 'prune_occurrences')
+        self.assertRaises(CommandError, call_command, 'prune_occurrences', 'Occurrence')
+        self.assertRaises(CommandError, call_command, 'prune_occurrences', 'django_timetable.Missing')
+        self.assertEqual(self.series.occurrences.count(), len(self.occurrences))
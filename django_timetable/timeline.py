@@ -0,0 +1,138 @@
+import base64
+import datetime
+import heapq
+import itertools
+
+from django.db.models import Q
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(start, series_id, original_start):
+    raw = '%s|%s|%s' % (start.strftime(CURSOR_DATETIME_FORMAT), series_id,
+                        original_start.strftime(CURSOR_DATETIME_FORMAT))
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor)).decode('ascii')
+        start, series_id, original_start = raw.split('|')
+        return (datetime.datetime.strptime(start, CURSOR_DATETIME_FORMAT),
+                int(series_id),
+                datetime.datetime.strptime(original_start, CURSOR_DATETIME_FORMAT))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid timeline cursor: %r" % (cursor, ))
+
+
+class _SeriesStream(object):
+    """
+    Occurrences generated from series rule which are not persisted yet.
+    Persisted original starts are loaded lazily (in chunks) only when
+    generated occurrence is going to be returned, so series which don't
+    reach current page don't cost any query.
+    """
+    def __init__(self, series, starts, chunk_size):
+        self.series = series
+        self.starts = starts
+        self.chunk_size = chunk_size
+        self._persisted = set()
+        self._covered_from = None
+        self._covered_to = None
+        self._complete = False
+
+    def next_start(self):
+        for start in self.starts:
+            return start
+        return None
+
+    def is_persisted(self, original_start):
+        # generated starts are ascending so we only move loaded window forward
+        if (self._covered_from is None or
+            (not self._complete and original_start > self._covered_to)):
+            persisted = list(self.series.occurrences.filter(original_start__gte=original_start)
+                                                   .order_by('original_start')
+                                                   .values_list('original_start', flat=True)[:self.chunk_size])
+            self._persisted = set(persisted)
+            self._covered_from = original_start
+            self._complete = len(persisted) < self.chunk_size
+            self._covered_to = persisted[-1] if persisted else original_start
+        return original_start in self._persisted
+
+
+def get_timeline(series, after=None, limit=50, cursor=None, defaults=None):
+    """
+    Returns page of occurrences from all given series (queryset) ordered by
+    (start, series id, original start) together with opaque cursor for the
+    next page (None when there are no more occurrences).
+
+    Per series rule expansions and persisted occurrences are merged lazily
+    (k-way heap merge) so cost is proportional to page size. Not persisted
+    occurrences are returned as unsaved occurrence instances.
+    """
+    defaults = defaults or {}
+    if cursor is not None:
+        cursor_key = decode_cursor(cursor)
+        after = cursor_key[0]
+    else:
+        cursor_key = None
+        after = after or datetime.datetime.now()
+
+    if limit <= 0:
+        return [], None
+    occurrence_model = series.model.occurrences.related.model
+    # stored occurrences can be moved beyond their series bounds so they
+    # are not limited to overlapping series
+    persisted = occurrence_model._default_manager.filter(event__in=series)
+    if hasattr(series, 'overlapping'):
+        series = series.overlapping(after)
+    if cursor_key is not None:
+        start, series_id, original_start = cursor_key
+        persisted = persisted.filter(Q(start__gt=start)
+                                     | Q(start=start, event__gt=series_id)
+                                     | Q(start=start, event=series_id,
+                                         original_start__gt=original_start))
+    else:
+        persisted = persisted.filter(start__gte=after)
+    persisted = iter(persisted.order_by('start', 'event__id', 'original_start')[:limit+1])
+
+    heap = []
+    counter = itertools.count()
+    def push_persisted():
+        for occurrence in persisted:
+            key = (occurrence.start, occurrence.event_id, occurrence.original_start)
+            heapq.heappush(heap, (key, next(counter), None, occurrence))
+            return
+
+    def push_generated(stream):
+        while True:
+            start = stream.next_start()
+            if start is None:
+                return
+            key = (start, stream.series.pk, start)
+            if cursor_key is not None and key <= cursor_key:
+                continue
+            heapq.heappush(heap, (key, next(counter), stream, None))
+            return
+
+    for s in series:
+        push_generated(_SeriesStream(s, s._get_starts(after), limit+1))
+    push_persisted()
+
+    result = []
+    keys = []
+    while heap and len(result) <= limit:
+        key, _, stream, occurrence = heapq.heappop(heap)
+        if stream is None:
+            push_persisted()
+        else:
+            push_generated(stream)
+            if stream.is_persisted(key[2]):
+                continue
+            occurrence = stream.series._get_occurrence(key[2], occurrence_model, **defaults)
+        result.append(occurrence)
+        keys.append(key)
+
+    if len(result) > limit:
+        return result[:limit], encode_cursor(*keys[limit-1])
+    return result, None